@@ -0,0 +1,76 @@
+'''Microbenchmark of request preparation in fossology.utils.Connection
+
+Compares preparing requests through the cached request templates with
+    preparing them through requests.Session as a plain wrapper would.
+    No requests are sent.
+
+Usage: python benchmarks/bench_request_builder.py [iterations]
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from requests import Request
+
+from fossology import utils
+
+
+SERVER = 'http://localhost:8085/repo/api/v1'
+
+SEARCH_HEADERS = {
+        'searchType': 'allfiles',
+        'filename': None,
+        'tag': None,
+        'filesizemin': None,
+        'filesizemax': None,
+        'license': 'AGPL-3.0',
+        'copyright': None,
+        }
+
+
+def session_prepare(connection, method, url_fragments, **kwargs):
+    '''Prepares a request the way Connection did before templates'''
+    url = utils._join_url(connection.server, *url_fragments)
+    return connection.session.prepare_request(
+            Request(method=method, url=url, **kwargs))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    connection = utils.Connection(server=SERVER)
+    connection.headers.update({'accept': 'application/json',
+        'Authorization': 'Bearer token'})
+
+    cases = [
+        ('GET uploads/<id>', 'GET', ['uploads', 42],
+            {'headers': utils.JSON_HEADERS}),
+        ('GET search', 'GET', ['search'], {'headers': SEARCH_HEADERS}),
+        ('PATCH folders/<id>', 'PATCH', ['folders', 7],
+            {'headers': {'name': 'renamed'}}),
+        ]
+
+    print('{:<22}{:>14}{:>14}{:>10}'.format(
+        'case', 'session (us)', 'template (us)', 'speedup'))
+    for name, method, url_fragments, kwargs in cases:
+        # Both paths must produce the same request
+        expected = session_prepare(connection, method, url_fragments,
+                **kwargs)
+        actual = connection._prepare(method, url_fragments, **kwargs)
+        assert (expected.url, dict(expected.headers)) == \
+                (actual.url, dict(actual.headers)), name
+
+        before = timeit.timeit(lambda: session_prepare(connection, method,
+            url_fragments, **kwargs), number=iterations)
+        after = timeit.timeit(lambda: connection._prepare(method,
+            url_fragments, **kwargs), number=iterations)
+
+        print('{:<22}{:>14.2f}{:>14.2f}{:>9.1f}x'.format(name,
+            before / iterations * 1e6, after / iterations * 1e6,
+            before / after))
+
+
+if __name__ == '__main__':
+    main()
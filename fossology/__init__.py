@@ -1,4 +1,5 @@
 from .api import Fossology
 from .api import Upload
+from .utils import Deadline
 
 __all__ = ['uploads', 'exceptions']
@@ -1,35 +1,76 @@
 import json
+import os
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
-from fossology import utils
+from fossology import archive, profiling, utils
 from fossology.exceptions import FossologyError
 from fossology.resources import Upload, Folder, User, Job, folder, job, SearchResult
 
 
 class Fossology():
-    def __init__(self, server, auth):
+    # Whether the connection is closed with this client
+    _owns_connection = False
 
+    def __init__(self, server, auth=None, timeout=utils.DEFAULT_TIMEOUT,
+            hedge_percentile=None, hedge_budget=0.05, token=None):
+
+        self.server = server
         api_server = utils._join_url(server, 'api/v1')
 
         # setup connection
-        self.connection = utils.Connection(server=api_server)
+        self.connection = utils.Connection(server=api_server,
+                timeout=timeout,
+                hedge_percentile=hedge_percentile,
+                hedge_budget=hedge_budget)
+
+        # Copies made by pickle share their process' connection instead
+        self._owns_connection = True
 
         # Add common headers to the connection
         self.connection.headers.update({
             'accept': 'application/json'
             })
 
-        # Request the server for an auth token
-        self.generate_auth_token(**auth)
+        # Reuse an existing token, or request one from the server
+        if token is not None:
+            self.connection.headers.update({'Authorization': token})
+        else:
+            self.generate_auth_token(**auth)
 
         # (TODO): Setup logger if requested
 
     def __del__(self):
 
         # close the connection
-        self.connection.close_connection()
+        if self._owns_connection:
+            self.connection.close_connection()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_owns_connection'] = False
+        return state
+
+    @classmethod
+    def from_config(cls, config):
+        '''Creates a client from the output of config()'''
+        return cls(**config)
+
+    def config(self):
+        '''Returns the settings needed to recreate this client
+
+        The result is a small dict that includes the auth token, so
+            clients created from it don't request a new token.
+        '''
+        return {'server': self.server,
+                'token': self.connection.headers.get('Authorization'),
+                'timeout': self.connection.timeout,
+                'hedge_percentile': self.connection.hedge_percentile,
+                'hedge_budget': self.connection.hedge_budget}
 
 
+    @profiling.profiled
     def generate_auth_token(self, username, password, token_expire,
                                 token_name=None, token_scope='read'):
         '''Requests a new token from the fossology server
@@ -41,7 +82,7 @@ class Fossology():
         # Create the URL for this endpoint
         endpoint_fragment = 'tokens'
 
-        headers = {'Content-Type': 'application/json'}
+        headers = utils.JSON_HEADERS
 
         # Prepare data to send with the request
         payload = json.dumps({"username": username,
@@ -69,11 +110,12 @@ class Fossology():
                     response_data['type'])
 
 
+    @profiling.profiled
     def get_all_uploads(self):
         '''Returns a list of all uploads on the server'''
         uploads = []
         endpoint_fragment = 'uploads'
-        headers = {'Content-Type': 'application/json'}
+        headers = utils.JSON_HEADERS
 
         # request a list of all uploads from the server
         server_response = self.connection.get(
@@ -100,9 +142,17 @@ class Fossology():
         return uploads
 
 
+    @profiling.profiled
     def new_upload(self, target_folder, fileInput,
-            upload_description=None, public='public'):
-        '''Create a new upload on the server'''
+            upload_description=None, public='public',
+            exclude=None, compression='gz'):
+        '''Create a new upload on the server
+
+        fileInput may be an archive or a directory. A directory is
+            streamed to the server as a compressed tar archive
+            (see archive.stream_directory), skipping entries that
+            match the exclude patterns.
+        '''
         endpoint_fragments = ['uploads']
 
         target_folder_id = target_folder.folder_id
@@ -111,10 +161,54 @@ class Fossology():
                     'uploadDescription':upload_description,
                     'public':public}
 
-        server_response = self.connection.upload_file(
+        if os.path.isdir(fileInput):
+            server_response = self.connection.upload_stream(
+                    url_fragments=endpoint_fragments,
+                    headers=headers,
+                    filename=archive.archive_name(fileInput, compression),
+                    chunks=archive.stream_directory(fileInput,
+                        compression=compression, exclude=exclude))
+        else:
+            server_response = self.connection.upload_file(
+                    url_fragments=endpoint_fragments,
+                    headers=headers,
+                    file=fileInput)
+
+        response_code = server_response.status_code
+
+        if response_code == 201:
+            response_data = server_response.json()
+
+            # fossology returns an upload ID.
+            # Create an upload object with it
+            return Upload(
+                upload_id = response_data['message'],
+                folder_id = target_folder_id,
+                folder_name = target_folder_name,
+                description = upload_description,
+                connection=self.connection)
+
+
+    def _new_server_side_upload(self, target_folder, upload_type, details,
+            upload_description=None, public='public'):
+        '''Create an upload whose content the server fetches itself'''
+        endpoint_fragments = ['uploads']
+
+        target_folder_id = target_folder.folder_id
+        target_folder_name = target_folder.folder_name
+        headers = dict(utils.JSON_HEADERS,
+                    folderId=target_folder_id,
+                    uploadDescription=upload_description,
+                    public=public,
+                    uploadType=upload_type)
+
+        # Leave out the details that were not given
+        payload = json.dumps({key: value for key, value in details.items()
+                    if value is not None})
+
+        server_response = self.connection.post(
                 url_fragments=endpoint_fragments,
-                headers=headers,
-                file=fileInput)
+                headers=headers, data=payload)
 
         response_code = server_response.status_code
 
@@ -131,11 +225,90 @@ class Fossology():
                 connection=self.connection)
 
 
+    @profiling.profiled
+    def new_upload_from_url(self, target_folder, url, name=None,
+            accept=None, reject=None, max_recursion_depth=None,
+            upload_description=None, public='public'):
+        '''Create a new upload that the server downloads from a URL'''
+        details = {'url': url,
+                    'name': name or url.rstrip('/').split('/')[-1],
+                    'accept': accept,
+                    'reject': reject,
+                    'maxRecursionDepth': max_recursion_depth}
+
+        return self._new_server_side_upload(target_folder, 'url', details,
+                upload_description=upload_description, public=public)
+
+
+    @profiling.profiled
+    def new_upload_from_vcs(self, target_folder, vcs_url, vcs_type='git',
+            vcs_branch=None, vcs_name=None, vcs_username=None,
+            vcs_password=None, upload_description=None, public='public'):
+        '''Create a new upload that the server checks out from a VCS'''
+        details = {'vcsType': vcs_type,
+                    'vcsUrl': vcs_url,
+                    'vcsBranch': vcs_branch,
+                    'vcsName': vcs_name,
+                    'vcsUsername': vcs_username,
+                    'vcsPassword': vcs_password}
+
+        return self._new_server_side_upload(target_folder, 'vcs', details,
+                upload_description=upload_description, public=public)
+
+
+    @profiling.profiled
+    def new_upload_from_server(self, target_folder, path, name=None,
+            upload_description=None, public='public'):
+        '''Create a new upload from a path on the FOSSology server'''
+        details = {'path': path,
+                    'name': name}
+
+        return self._new_server_side_upload(target_folder, 'server', details,
+                upload_description=upload_description, public=public)
+
+
+    def new_uploads(self, uploads, max_workers=8):
+        '''Submit several server side uploads concurrently
+
+        uploads is a list of dicts, each holding an 'upload_type' of
+            'url', 'vcs' or 'server' and the arguments for the matching
+            new_upload_from_* method.
+
+        Returns a list in the same order, holding the new Upload or
+            the exception raised while submitting it. Deadlines of the
+            calling thread apply to every submission.
+        '''
+        methods = {'url': self.new_upload_from_url,
+                    'vcs': self.new_upload_from_vcs,
+                    'server': self.new_upload_from_server}
+        deadlines = list(utils._active_deadlines())
+
+        def submit(upload):
+            try:
+                # Deadlines are per thread, so enter them in the worker
+                with ExitStack() as stack:
+                    for deadline in deadlines:
+                        stack.enter_context(deadline)
+
+                    kwargs = dict(upload)
+                    upload_type = kwargs.pop('upload_type', None)
+                    if upload_type not in methods:
+                        raise ValueError('Unknown upload type: {}'.format(
+                            upload_type))
+                    return methods[upload_type](**kwargs)
+            except Exception as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(submit, uploads))
+
+
+    @profiling.profiled
     def upload(self, upload_id):
         '''Gets a single upload from the server'''
         endpoint_fragments = ['uploads', upload_id]
 
-        headers = {'Content-Type': 'application/json'}
+        headers = utils.JSON_HEADERS
 
         # request upload data from server
         server_response = self.connection.get(
@@ -157,17 +330,19 @@ class Fossology():
                 connection=self.connection)
 
 
+    @profiling.profiled
     def folder(self, folder_id):
         '''Gets a single folder from the server'''
         return folder(folder_id=folder_id,
                 connection=self.connection)
 
 
+    @profiling.profiled
     def get_all_folders(self):
         '''Returns a list of all folders on the server'''
         folders = []
         endpoint_fragment = 'folders'
-        headers = {'Content-Type': 'application/json'}
+        headers = utils.JSON_HEADERS
 
         # Request a list of all accessible folders
         server_response = self.connection.get(
@@ -189,6 +364,7 @@ class Fossology():
         return folders
 
 
+    @profiling.profiled
     def new_folder(self, parent_folder, folder_name,
                     folder_description=None):
         '''Create a new folder on the server'''
@@ -197,11 +373,12 @@ class Fossology():
                             folder_name=folder_name,
                             folder_description=folder_description)
 
+    @profiling.profiled
     def get_all_users(self):
         '''Get a list of all users on the server'''
         users = []
         endpoint_fragment = 'users'
-        headers = {'Content-Type': 'application/json'}
+        headers = utils.JSON_HEADERS
 
         # Request a list of all users
         server_response = self.connection.get(
@@ -227,11 +404,12 @@ class Fossology():
 
         return users
 
+    @profiling.profiled
     def user(self, user_id):
         '''Gets a single user from the server'''
         endpoint_fragments = ['users', user_id]
 
-        headers = {'Content-Type': 'application/json'}
+        headers = utils.JSON_HEADERS
 
         # request user data
         server_response = self.connection.get(
@@ -254,22 +432,33 @@ class Fossology():
                     connection = self.connection)
 
 
+    @profiling.profiled
     def job(self, job_id):
         '''Gets a single job from the server'''
         return job(job_id=job_id,
                 connection=self.connection)
 
 
-    def get_all_jobs(self, limit=None):
-        '''Gets a list of all jobs on the server'''
+    @profiling.profiled
+    def get_all_jobs(self, limit=None, upload=None):
+        '''Gets a list of all jobs on the server
+
+        If upload is given, only the jobs of that upload are requested.
+            Servers that don't support this filter return all jobs.
+        '''
         jobs = []
         endpoint_fragment = 'jobs'
-        headers = {'Content-Type': 'application/json',
-                'limit': str(limit)}
+        headers = dict(utils.JSON_HEADERS,
+                limit=None if limit is None else str(limit))
+
+        kwargs = {}
+        if upload is not None:
+            kwargs['params'] = {'upload': upload.upload_id}
 
         # request a list of all jobs from the server
         server_response = self.connection.get(
-                url_fragments=[endpoint_fragment], headers=headers)
+                url_fragments=[endpoint_fragment], headers=headers,
+                **kwargs)
         response_code = server_response.status_code
 
 
@@ -285,17 +474,21 @@ class Fossology():
                     upload_id = job['uploadId'],
                     user_id = job['userId'],
                     group_id = job['groupId'],
+                    eta = job.get('eta'),
+                    status = job.get('status'),
                     connection = self.connection))
 
         return jobs
 
 
+    @profiling.profiled
     def schedule_agents(self, upload, agents):
         '''Schedule agents on an existing upload'''
 
         return upload.schedule_agents(agents=agents)
 
 
+    @profiling.profiled
     def search(self, search_type=None, filename=None, tag=None,
                 filesizemin=None, filesizemax=None, license=None,
                 copyright=None):
@@ -0,0 +1,209 @@
+import fnmatch
+import lzma
+import os
+import queue
+import tarfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Uncompressed bytes handed to a compression worker at a time
+BLOCK_SIZE = 1024 * 1024
+
+COMPRESSIONS = ('gz', 'xz')
+
+_END = object()
+
+
+def _compress_gz(block, level):
+    '''Compresses a block into a standalone gzip member
+
+    Concatenated gzip members form a valid gzip stream, which
+        lets blocks be compressed independently of each other
+    '''
+    # wbits=31 writes a gzip header with a zero mtime,
+    #   so the output only depends on the input bytes
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+def _compress_xz(block, level):
+    '''Compresses a block into a standalone xz stream'''
+    return lzma.compress(block, format=lzma.FORMAT_XZ, preset=level)
+
+
+_COMPRESSORS = {
+        'gz': (_compress_gz, 6),
+        'xz': (_compress_xz, 6),
+        }
+
+
+def archive_name(directory, compression='gz'):
+    '''Returns the filename used when uploading a directory'''
+    base = os.path.basename(os.path.normpath(directory))
+    return '{}.tar.{}'.format(base, compression)
+
+
+def _is_excluded(relative_path, exclude):
+    '''Checks a path relative to the archive root against exclude patterns'''
+    name = os.path.basename(relative_path)
+    for pattern in exclude:
+        if fnmatch.fnmatch(relative_path, pattern) or \
+                fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def _walk(directory, exclude):
+    '''Yields (path, arcname) for every entry in sorted order'''
+    root_name = os.path.basename(os.path.normpath(directory))
+    yield directory, root_name
+
+    for dirpath, dirnames, filenames in os.walk(directory):
+        relative_dir = os.path.relpath(dirpath, directory)
+        if relative_dir == os.curdir:
+            relative_dir = ''
+
+        # Sort in place so that os.walk also descends in order
+        dirnames.sort()
+        kept = []
+        for name in dirnames:
+            relative_path = os.path.join(relative_dir, name)
+            if not _is_excluded(relative_path, exclude):
+                kept.append(name)
+        dirnames[:] = kept
+
+        entries = sorted(dirnames + filenames)
+        for name in entries:
+            relative_path = os.path.join(relative_dir, name)
+            if name in filenames and _is_excluded(relative_path, exclude):
+                continue
+            yield (os.path.join(dirpath, name),
+                    os.path.join(root_name, relative_path))
+
+
+def _normalize(tarinfo):
+    '''Strips owner information so archives are reproducible'''
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ''
+    return tarinfo
+
+
+class _BlockWriter():
+    '''File-like sink that submits fixed size blocks for compression
+
+    Futures are queued in submission order, so the consumer can
+        emit compressed blocks in the same order they were written.
+    '''
+
+    def __init__(self, executor, compress, level, futures, stop):
+        self.executor = executor
+        self.compress = compress
+        self.level = level
+        self.futures = futures
+        self.stop = stop
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_SIZE:
+            block = bytes(self.buffer[:BLOCK_SIZE])
+            del self.buffer[:BLOCK_SIZE]
+            self._submit(block)
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def _submit(self, block):
+        future = self.executor.submit(self.compress, block, self.level)
+        self._put(future)
+
+    def _put(self, item):
+        # Block while the consumer is behind, but give up
+        #   if it has stopped reading altogether
+        while not self.stop.is_set():
+            try:
+                self.futures.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Abandoned()
+
+
+class _Abandoned(Exception):
+    '''Raised inside the writer thread when the consumer went away'''
+
+
+def stream_directory(directory, compression='gz', exclude=None,
+        workers=None, level=None):
+    '''Returns an iterator of a compressed tar archive of a directory
+
+    The archive is built in a background thread and compressed in
+        blocks by a pool of worker threads, so nothing is written
+        to disk. Entries are added in sorted order and owner
+        information is dropped, so the same tree always produces
+        the same archive.
+
+    exclude is a list of glob patterns matched against both the
+        path relative to the directory and the entry's basename.
+
+    Arguments are checked right away, before any byte is produced,
+        so a bad call fails before an upload has started.
+    '''
+    if compression not in _COMPRESSORS:
+        raise ValueError('Unsupported compression: {}'.format(compression))
+    if not os.path.isdir(directory):
+        raise NotADirectoryError(directory)
+
+    compress, default_level = _COMPRESSORS[compression]
+    level = default_level if level is None else level
+    workers = workers or os.cpu_count() or 1
+    exclude = list(exclude or [])
+
+    return _stream_directory(directory, compress, level, workers, exclude)
+
+
+def _stream_directory(directory, compress, level, workers, exclude):
+    '''Yields the compressed archive chunks of stream_directory'''
+    # Bounded, so the tar writer can't run far ahead of the network
+    futures = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        writer = _BlockWriter(executor, compress, level, futures, stop)
+
+        def build_archive():
+            try:
+                with tarfile.open(fileobj=writer, mode='w|',
+                        format=tarfile.PAX_FORMAT) as tar:
+                    for path, arcname in _walk(directory, exclude):
+                        tar.add(path, arcname=arcname,
+                                recursive=False, filter=_normalize)
+                writer.flush()
+                writer._put(_END)
+            except _Abandoned:
+                pass
+            except Exception as error:
+                try:
+                    writer._put(error)
+                except _Abandoned:
+                    pass
+
+        builder = threading.Thread(target=build_archive, daemon=True)
+        builder.start()
+
+        try:
+            while True:
+                item = futures.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item.result()
+        finally:
+            stop.set()
+            builder.join()
@@ -0,0 +1,244 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # Not available on Windows
+    fcntl = None
+
+from fossology.events import FINISHED_STATUSES
+from fossology.exceptions import FossologyResourceNotReadyError
+
+
+class ReportCache():
+    '''On-disk cache of generated reports
+
+    Reports are stored under a key derived from the upload id, the
+        report format and the latest completed scan job of the upload,
+        so a report is reused until the upload is scanned again.
+
+    Files are written to a temporary name and renamed into place, and
+        storing, opening and evicting reports happens under a lock
+        file, so several processes can share one cache directory.
+        Reports are only handed out as open files or copies, which
+        stay valid when the cached report is evicted. When the cache
+        grows past max_size bytes the least recently used reports are
+        removed, and a report larger than max_size is not kept.
+        Partial downloads older than stale_download_age seconds,
+        left by processes that died, are removed with them.
+    '''
+
+    # Seconds after which a partial download is taken to be left
+    #   behind by a process that died, and removed
+    stale_download_age = 3 * 3600
+
+    def __init__(self, directory, max_size=1024 ** 3):
+        self.directory = directory
+        self.max_size = max_size
+
+        self._objects = os.path.join(directory, 'objects')
+        # Jobs that generated reports, which don't change scan results
+        self._report_jobs = os.path.join(directory, 'report-jobs')
+        self._lock_file = os.path.join(directory, 'lock')
+
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._report_jobs, exist_ok=True)
+
+    @staticmethod
+    def key(upload_id, report_format, job_id):
+        '''Returns the cache key for a report'''
+        text = '{}\0{}\0{}'.format(upload_id, report_format, job_id)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._objects, key)
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_file, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def get(self, key):
+        '''Returns a cached report opened for reading, or None'''
+        path = self._path(key)
+        with self._locked():
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                return None
+            # Mark the report as recently used
+            os.utime(path)
+        return f
+
+    def _download(self, chunks):
+        '''Writes chunks of bytes to a new temporary file in the cache'''
+        fd, tmp_path = tempfile.mkstemp(dir=self._objects, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path
+
+    def _store(self, key, tmp_path):
+        '''Moves a downloaded report into the cache
+
+        Returns the report opened for reading.
+        '''
+        path = self._path(key)
+        with self._locked():
+            os.replace(tmp_path, path)
+            f = open(path, 'rb')
+            self._evict(keep=path)
+        return f
+
+    def put(self, key, chunks):
+        '''Stores a report from an iterator of bytes
+
+        Returns the report opened for reading. Reports larger than
+            max_size are returned without being kept.
+        '''
+        tmp_path = self._download(chunks)
+        if os.path.getsize(tmp_path) > self.max_size:
+            f = open(tmp_path, 'rb')
+            os.unlink(tmp_path)
+            return f
+        return self._store(key, tmp_path)
+
+    def evict(self):
+        '''Removes least recently used reports until under max_size'''
+        with self._locked():
+            self._evict()
+
+    def _evict(self, keep=None):
+        entries = []
+        total = 0
+        stale = time.time() - self.stale_download_age
+        for entry in os.scandir(self._objects):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith('.tmp-'):
+                # Downloads in progress are not part of the cache yet
+                if stat.st_mtime < stale:
+                    entries.append((0, stat.st_size, entry.path))
+                    total += stat.st_size
+                continue
+            total += stat.st_size
+            # The report just stored is never evicted
+            if entry.path != keep:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        # Stale downloads sort first and are always removed
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size and mtime:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _report_job_marker(self, upload_id, job_id):
+        return os.path.join(self._report_jobs,
+                '{}-{}'.format(upload_id, job_id))
+
+    def _remembered_report_jobs(self, upload_id):
+        '''Returns the ids of the report jobs of an upload'''
+        prefix = '{}-'.format(upload_id)
+        return set(int(name[len(prefix):])
+                for name in os.listdir(self._report_jobs)
+                if name.startswith(prefix))
+
+    def _remember_report_job(self, upload_id, job_id):
+        open(self._report_job_marker(upload_id, job_id), 'a').close()
+
+    def scan_state(self, fossology, upload):
+        '''Returns the latest completed scan job id of an upload
+
+        Returns False while a scan of the upload is still running,
+            as its reports are about to change.
+        '''
+        # Read before listing the jobs, so a report job created in
+        #   between is not mistaken for a deleted one
+        report_jobs = self._remembered_report_jobs(upload.upload_id)
+
+        jobs = [job for job in fossology.get_all_jobs(upload=upload)
+                if str(job.upload_id) == str(upload.upload_id)]
+
+        latest = None
+        for job in jobs:
+            if int(job.job_id) in report_jobs:
+                continue
+            if job.status not in FINISHED_STATUSES:
+                return False
+            if job.status == 'Completed' and \
+                    (latest is None or int(job.job_id) > latest):
+                latest = int(job.job_id)
+
+        # Report jobs older than the latest scan, or deleted from the
+        #   server, can't be mistaken for scans anymore
+        listed = set(int(job.job_id) for job in jobs)
+        for job_id in report_jobs:
+            if job_id not in listed or \
+                    (latest is not None and job_id < latest):
+                try:
+                    os.unlink(self._report_job_marker(upload.upload_id,
+                        job_id))
+                except FileNotFoundError:
+                    pass
+        return latest
+
+    def fetch(self, fossology, upload, reportFormat, filename=None,
+            retry_interval=5):
+        '''Writes a report for the upload to filename, from the cache
+            if possible, and returns filename
+
+        filename defaults to <upload id>.<reportFormat>. On a miss the
+            report is generated, downloaded into the cache and, unless
+            a scan is still running or it is larger than max_size,
+            kept for later calls.
+        '''
+        filename = filename or '{}.{}'.format(upload.upload_id,
+                reportFormat)
+
+        job_id = self.scan_state(fossology, upload)
+        key = self.key(upload.upload_id, reportFormat, job_id)
+
+        cached = self.get(key) if job_id is not False else None
+        if cached is not None:
+            return self._deliver(cached, filename)
+
+        report = upload.request_report_generation(reportFormat=reportFormat)
+        self._remember_report_job(upload.upload_id, report.report_id)
+
+        # Wait for the report to be generated
+        while True:
+            try:
+                tmp_path = self._download(report.iter_content())
+                break
+            except FossologyResourceNotReadyError as error:
+                time.sleep(int(error.retry_after or retry_interval))
+
+        if job_id is False or os.path.getsize(tmp_path) > self.max_size:
+            # Results of a running scan, and reports that don't fit in
+            #   the cache, are handed out but not kept
+            shutil.move(tmp_path, filename)
+            return filename
+
+        return self._deliver(self._store(key, tmp_path), filename)
+
+    @staticmethod
+    def _deliver(cached, filename):
+        with cached, open(filename, 'wb') as f:
+            shutil.copyfileobj(cached, f)
+        return filename
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+from collections import namedtuple
+
+from fossology import utils
+from fossology.exceptions import FossologyError
+
+
+# Job statuses after which a job will not change anymore
+FINISHED_STATUSES = ('Completed', 'Failed', 'Killed')
+
+CREATED = 'created'
+FINISHED = 'finished'
+
+JobEvent = namedtuple('JobEvent', ['kind', 'job'])
+
+
+class JobEventFeed():
+    '''Emits events for jobs that were created or finished
+
+    The feed remembers the highest job id it has seen and the status
+        of every job that has not finished yet. Each poll asks the
+        server only for the newest jobs, with a limit just large
+        enough to reach back to the highest seen id, so the cost of a
+        poll depends on how much changed rather than on the number of
+        jobs on the server. Jobs still running that fall outside that
+        window are looked up individually.
+
+    This relies on the server listing the most recent jobs first.
+
+    If state_file is given the mark is loaded from and saved to it,
+        so a restarted feed continues where it stopped. Without any
+        state the first poll only records the current jobs, reading
+        all of them so that every running job is tracked.
+
+    A poll that fails leaves the feed as it was, so the next poll
+        emits its events again. Pending jobs deleted from the server
+        are dropped without an event.
+    '''
+
+    def __init__(self, fossology, state_file=None, min_limit=10):
+        self.fossology = fossology
+        self.state_file = state_file
+        self.min_limit = min_limit
+
+        self.high_water = None
+        self.pending = {}       # job id -> last seen status
+        self._limit = min_limit
+        self._callbacks = []
+
+        if state_file and os.path.exists(state_file):
+            self._load()
+
+    def _load(self):
+        with open(self.state_file) as f:
+            state = json.load(f)
+        self.high_water = state['high_water']
+        self.pending = {int(job_id): status
+                for job_id, status in state['pending'].items()}
+        self._limit = max(self.min_limit, state.get('limit', 0))
+
+    def _save(self):
+        if not self.state_file:
+            return
+        utils._write_json(self.state_file, {
+            'high_water': self.high_water,
+            'pending': self.pending,
+            'limit': self._limit,
+            })
+
+    def subscribe(self, callback, kinds=(CREATED, FINISHED)):
+        '''Calls callback(event) for every event of the given kinds'''
+        self._callbacks.append((callback, kinds))
+
+    def _fetch_new(self):
+        '''Returns the jobs with an id above the high-water mark'''
+        limit = self._limit
+        while True:
+            jobs = self.fossology.get_all_jobs(limit=limit)
+            ids = [int(job.job_id) for job in jobs]
+
+            # Covered when the server ran out of jobs or the page
+            #   reaches back to jobs that were already seen
+            if len(jobs) < limit or (self.high_water is not None and
+                    min(ids) <= self.high_water):
+                break
+            limit *= 2
+
+        if self.high_water is None:
+            return jobs, jobs
+
+        # Next time, start with room for as many new jobs as this time
+        new = [job for job in jobs if int(job.job_id) > self.high_water]
+        self._limit = max(self.min_limit, len(new) + 1)
+        return jobs, new
+
+    def poll(self):
+        '''Fetches changes since the last poll and returns the events
+
+        Subscribed callbacks are called for each event.
+        '''
+        events = []
+        baseline = self.high_water is None
+        jobs, new = self._fetch_new()
+        seen = {int(job.job_id): job for job in jobs}
+
+        # Only kept once every lookup succeeded
+        high_water = self.high_water
+        pending = dict(self.pending)
+
+        for job in sorted(new, key=lambda job: int(job.job_id)):
+            job_id = int(job.job_id)
+            high_water = max(high_water or job_id, job_id)
+
+            if job.status not in FINISHED_STATUSES:
+                pending[job_id] = job.status
+            if baseline:
+                continue
+
+            events.append(JobEvent(CREATED, job))
+            if job.status in FINISHED_STATUSES:
+                events.append(JobEvent(FINISHED, job))
+
+        new_ids = set(int(job.job_id) for job in new)
+        for job_id in sorted(pending):
+            if job_id in new_ids:
+                continue
+            job = seen.get(job_id)
+            if job is None:
+                try:
+                    job = self.fossology.job(job_id)
+                except FossologyError as error:
+                    if error.err_code != 404:
+                        raise
+                    # Deleted, for example with its upload
+                    del pending[job_id]
+                    continue
+            if job is None:
+                continue
+            if job.status in FINISHED_STATUSES:
+                del pending[job_id]
+                events.append(JobEvent(FINISHED, job))
+            else:
+                pending[job_id] = job.status
+
+        self.high_water = high_water
+        self.pending = pending
+        self._save()
+
+        for event in events:
+            for callback, kinds in self._callbacks:
+                if event.kind in kinds:
+                    callback(event)
+        return events
+
+    def __aiter__(self):
+        return _AsyncJobEvents(self, interval=5)
+
+    def aiter(self, interval=5):
+        '''Returns an async iterator of events, polling every interval seconds
+
+        Polls run in the default executor so the event loop is not
+            blocked by network calls.
+        '''
+        return _AsyncJobEvents(self, interval=interval)
+
+
+class _AsyncJobEvents():
+    '''Async iterator over the events of a JobEventFeed'''
+
+    def __init__(self, feed, interval):
+        self.feed = feed
+        self.interval = interval
+        self._events = []
+        self._polled = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        loop = asyncio.get_event_loop()
+        while not self._events:
+            if self._polled:
+                await asyncio.sleep(self.interval)
+            self._events = await loop.run_in_executor(None, self.feed.poll)
+            self._polled = True
+        return self._events.pop(0)
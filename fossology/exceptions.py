@@ -38,6 +38,28 @@ class FossologyResourceNotReadyError(FossologyError):
     def __str__(self):
         return self.err_msg
 
+class FossologyTimeoutError(FossologyError):
+    '''Raised when a request or a deadline runs out of time
+    '''
+    def __init__(self, err_msg='Request timed out.'):
+        super().__init__(err_code = None,
+                err_msg = err_msg,
+                err_type = 'ERROR')
+
+    def __str__(self):
+        return self.err_msg
+
+class FossologyCancelledError(FossologyError):
+    '''Raised when the requests of a cancelled deadline are abandoned
+    '''
+    def __init__(self, err_msg='Request cancelled.'):
+        super().__init__(err_code = None,
+                err_msg = err_msg,
+                err_type = 'ERROR')
+
+    def __str__(self):
+        return self.err_msg
+
 # class FossologyTokenConflictError(FossologyError):
 #     '''Raised when requesting a new token with an existing name'''
 #     def __init__(self):
@@ -0,0 +1,218 @@
+import re
+import sqlite3
+
+from fossology import parsers
+
+
+LICENSE = 'license'
+COPYRIGHT = 'copyright'
+
+# Where postings came from, so each source can be refreshed on its own
+_REPORT = 'report'
+_SEARCH = 'search'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS terms (
+    term_id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    UNIQUE (kind, value)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    upload_id INTEGER NOT NULL,
+    upload_tree_id INTEGER,
+    filename TEXT,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS postings_by_term
+    ON postings (term_id, upload_id);
+CREATE INDEX IF NOT EXISTS postings_by_upload
+    ON postings (upload_id, source);
+'''
+
+_TOKENS = re.compile(r'\s*(\(|\)|(?:\w+:)?"[^"]*"|[^\s()]+)')
+
+
+class LicenseIndex():
+    '''Local inverted index of license and copyright findings
+
+    Maps each license and copyright statement to the uploads and files
+        it was found in. Findings are added from downloaded reports and
+        from search results, and are replaced per upload (or per search
+        term) when added again. Queries never contact the server.
+
+    The index is kept in an SQLite database at path.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def _term_id(self, kind, value):
+        self._db.execute(
+                'INSERT OR IGNORE INTO terms (kind, value) VALUES (?, ?)',
+                (kind, value))
+        return self._db.execute(
+                'SELECT term_id FROM terms WHERE kind = ? AND value = ?',
+                (kind, value)).fetchone()[0]
+
+    def add_records(self, upload_id, records):
+        '''Replaces the report findings of an upload
+
+        records is an iterable of parsers.FileRecord.
+        '''
+        upload_id = int(upload_id)
+        term_ids = {}
+        postings = []
+
+        with self._db:
+            self._db.execute(
+                    'DELETE FROM postings WHERE upload_id = ? AND source = ?',
+                    (upload_id, _REPORT))
+
+            for record in records:
+                terms = [(LICENSE, value) for value in record.licenses] + \
+                        [(COPYRIGHT, value) for value in record.copyrights]
+                for term in terms:
+                    if term not in term_ids:
+                        term_ids[term] = self._term_id(*term)
+                    postings.append((term_ids[term], upload_id, None,
+                        record.filename, _REPORT))
+
+            self._db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?)',
+                    postings)
+
+    def add_report(self, upload_id, chunks, report_format):
+        '''Replaces the findings of an upload with those of a report
+
+        chunks is an iterable of bytes, such as Report.iter_content()
+            or an open report file.
+        '''
+        self.add_records(upload_id,
+                parsers.iter_records(chunks, report_format))
+
+    def add_search_results(self, search_results, license=None,
+            copyright=None):
+        '''Replaces the findings of a license or copyright search
+
+        Pass the same license or copyright given to Fossology.search.
+        '''
+        if (license is None) == (copyright is None):
+            raise ValueError('Pass exactly one of license or copyright')
+        kind, value = (LICENSE, license) if license is not None \
+                else (COPYRIGHT, copyright)
+
+        with self._db:
+            term_id = self._term_id(kind, value)
+            self._db.execute(
+                    'DELETE FROM postings WHERE term_id = ? AND source = ?',
+                    (term_id, _SEARCH))
+            self._db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?)',
+                    [(term_id, int(result.upload.upload_id),
+                        result.upload_tree_id, result.filename, _SEARCH)
+                        for result in search_results])
+
+    def remove_upload(self, upload_id):
+        '''Removes all findings of an upload'''
+        with self._db:
+            self._db.execute('DELETE FROM postings WHERE upload_id = ?',
+                    (int(upload_id),))
+
+    def _term_clause(self, kind, value):
+        # Values with wildcards match like shell globs
+        operator = 'GLOB' if ('*' in value or '?' in value) else '='
+        return ('SELECT term_id FROM terms WHERE kind = ? '
+                'AND value {} ?'.format(operator), (kind, value))
+
+    def uploads(self, kind, value):
+        '''Returns the set of upload ids with a license or copyright'''
+        clause, params = self._term_clause(kind, value)
+        rows = self._db.execute(
+                'SELECT DISTINCT upload_id FROM postings '
+                'WHERE term_id IN ({})'.format(clause), params)
+        return set(row[0] for row in rows)
+
+    def files(self, kind, value, upload_id=None):
+        '''Returns (upload_id, upload_tree_id, filename) for each match'''
+        clause, params = self._term_clause(kind, value)
+        query = ('SELECT DISTINCT upload_id, upload_tree_id, filename '
+                'FROM postings WHERE term_id IN ({})'.format(clause))
+        if upload_id is not None:
+            query += ' AND upload_id = ?'
+            params += (int(upload_id),)
+        return self._db.execute(query + ' ORDER BY upload_id, filename',
+                params).fetchall()
+
+    def all_uploads(self):
+        '''Returns the set of all upload ids in the index'''
+        rows = self._db.execute('SELECT DISTINCT upload_id FROM postings')
+        return set(row[0] for row in rows)
+
+    def query(self, expression):
+        '''Returns the sorted upload ids matching a boolean expression
+
+        Terms are written as license:VALUE or copyright:VALUE, a bare
+            VALUE being a license. Values containing spaces are quoted,
+            and * and ? act as wildcards. Terms are combined with AND,
+            OR, NOT and parentheses; adjacent terms imply AND.
+
+            (license:AGPL-3.0 OR license:GPL-3.0*) AND NOT copyright:"Acme"
+        '''
+        tokens = _TOKENS.findall(expression)
+        position = [0]
+
+        def peek():
+            return tokens[position[0]] if position[0] < len(tokens) else None
+
+        def take():
+            token = peek()
+            position[0] += 1
+            return token
+
+        def parse_or():
+            result = parse_and()
+            while peek() == 'OR':
+                take()
+                result = result | parse_and()
+            return result
+
+        def parse_and():
+            result = parse_not()
+            while peek() not in (None, 'OR', ')'):
+                if peek() == 'AND':
+                    take()
+                result = result & parse_not()
+            return result
+
+        def parse_not():
+            if peek() == 'NOT':
+                take()
+                return self.all_uploads() - parse_not()
+            return parse_term()
+
+        def parse_term():
+            token = take()
+            if token is None or token in ('AND', 'OR', ')'):
+                raise ValueError('Malformed query: {}'.format(expression))
+            if token == '(':
+                result = parse_or()
+                if take() != ')':
+                    raise ValueError('Unbalanced parentheses: {}'.format(
+                        expression))
+                return result
+
+            kind, value = LICENSE, token
+            match = re.match(r'(\w+):(.*)$', token)
+            if match and match.group(1) in (LICENSE, COPYRIGHT):
+                kind, value = match.groups()
+            return self.uploads(kind, value.strip('"'))
+
+        result = parse_or()
+        if peek() is not None:
+            raise ValueError('Malformed query: {}'.format(expression))
+        return sorted(result)
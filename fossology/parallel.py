@@ -0,0 +1,61 @@
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from fossology import utils
+
+
+# The client of a worker process, and the pickle and process it is for
+_client = None
+_client_key = None
+
+
+def _call(pickled_fossology, func, expires, item):
+    global _client, _client_key
+    # Unpickled once per worker, even when forked, so the worker gets
+    #   its own connection instead of sharing the parent's sockets
+    key = (os.getpid(), pickled_fossology)
+    if key != _client_key:
+        _client = pickle.loads(pickled_fossology)
+        _client_key = key
+
+    if expires is None:
+        return func(_client, item)
+    with utils.Deadline(max(0.0, expires - time.time())):
+        return func(_client, item)
+
+
+def process_map(fossology, func, items, max_workers=None, chunksize=1):
+    '''Calls func(client, item) for every item in a pool of processes
+
+    Meant for CPU heavy work such as hashing, compressing or parsing
+        reports, which threads can't spread across cores. Every worker
+        process unpickles the client once, reusing its auth token, and
+        keeps it (and its open connections) for all the items it
+        handles. Resource objects such as Upload passed as items share
+        that same connection.
+
+    The time limit of the calling thread's deadlines applies to the
+        requests made in the workers, but cancelling a deadline does
+        not reach other processes.
+
+    func must be a module level function so it can be pickled.
+        Returns the results in the order of items.
+    '''
+    # Deadlines can't be pickled, so workers get the wall clock time
+    #   at which the earliest one expires
+    expires = None
+    for deadline in utils._active_deadlines():
+        deadline.check()
+        remaining = deadline.remaining()
+        if remaining is not None:
+            at = time.time() + remaining
+            expires = at if expires is None else min(expires, at)
+
+    # The pickled client is small, so it is sent along with every
+    #   task rather than through an initializer (Python 3.7+ only)
+    call = partial(_call, pickle.dumps(fossology), func, expires)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(call, items, chunksize=chunksize))
@@ -0,0 +1,336 @@
+import abc
+import codecs
+from collections import namedtuple
+from xml.etree.ElementTree import XMLPullParser
+
+
+# License and copyright findings for a single file in a report
+FileRecord = namedtuple('FileRecord', ['filename', 'licenses', 'copyrights'])
+
+# Values used by SPDX to say that nothing is known
+_NO_VALUE = ('NOASSERTION', 'NONE', '')
+
+# Operators combining licenses in SPDX and DEP5 license expressions
+_LICENSE_OPERATORS = ('AND', 'OR')
+
+# Operator adding an exception, which is not a license, to a license
+_EXCEPTION_OPERATOR = 'WITH'
+
+
+def _unique(values):
+    '''Returns the values as a tuple, without duplicates or empty values'''
+    seen = []
+    for value in values:
+        value = value.strip()
+        if value.upper() not in _NO_VALUE and value not in seen:
+            seen.append(value)
+    return tuple(seen)
+
+
+def _license_terms(expression):
+    '''Splits a license expression into the licenses it references
+
+    "(MIT OR Apache-2.0)" gives MIT and Apache-2.0, the same
+        members an RDF report lists for that expression. Exceptions
+        are left out, so "GPL-2.0 WITH Classpath-exception-2.0"
+        gives GPL-2.0.
+    '''
+    terms = []
+    words = []
+    in_exception = False
+    for token in expression.replace('(', ' ').replace(')', ' ').split():
+        if token.upper() in _LICENSE_OPERATORS:
+            terms.append(' '.join(words))
+            words = []
+            in_exception = False
+        elif token.upper() == _EXCEPTION_OPERATOR:
+            in_exception = True
+        elif not in_exception:
+            words.append(token)
+    terms.append(' '.join(words))
+    return terms
+
+
+def _licenses(expressions):
+    '''Returns the unique licenses referenced by license expressions'''
+    return _unique(term for expression in expressions
+            for term in _license_terms(expression))
+
+
+class _LineParser(abc.ABC):
+    '''Base class for parsers of line oriented text reports
+
+    Bytes are decoded incrementally and only complete lines are
+        handed to parse_line, so input may be split anywhere.
+    '''
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(
+                errors='replace')
+        self._pending = ''
+
+    def feed(self, data):
+        '''Parses a chunk of the report, returns any completed records'''
+        records = []
+        text = self._pending + self._decoder.decode(data)
+        lines = text.split('\n')
+        self._pending = lines.pop()
+
+        for line in lines:
+            records.extend(self.parse_line(line.rstrip('\r')))
+        return records
+
+    def close(self):
+        '''Signals the end of the report, returns the remaining records'''
+        records = []
+        text = self._pending + self._decoder.decode(b'', final=True)
+        self._pending = ''
+        if text:
+            records.extend(self.parse_line(text.rstrip('\r')))
+        records.extend(self.finish())
+        return records
+
+    @abc.abstractmethod
+    def parse_line(self, line):
+        '''Parses a complete line, returns any completed records'''
+
+    @abc.abstractmethod
+    def finish(self):
+        '''Returns the records still held once all lines were parsed'''
+
+
+class SPDXTagValueParser(_LineParser):
+    '''Incremental parser for SPDX tag-value reports (spdx2tv)'''
+
+    def __init__(self):
+        super().__init__()
+        self._file = None
+        self._text_tag = None
+        self._text = []
+
+    def _emit(self):
+        if self._file is None:
+            return []
+        filename, licenses, copyrights = self._file
+        self._file = None
+        return [FileRecord(filename, _licenses(licenses),
+            _unique(copyrights))]
+
+    def _store(self, tag, value):
+        if self._file is None:
+            return
+        if tag in ('LicenseInfoInFile', 'LicenseConcluded'):
+            self._file[1].append(value)
+        elif tag == 'FileCopyrightText':
+            self._file[2].extend(value.splitlines())
+
+    def parse_line(self, line):
+        # Inside a multi-line <text> value
+        if self._text_tag is not None:
+            if '</text>' in line:
+                self._text.append(line.split('</text>', 1)[0])
+                self._store(self._text_tag, '\n'.join(self._text))
+                self._text_tag = None
+            else:
+                self._text.append(line)
+            return []
+
+        if ':' not in line or line.startswith('#'):
+            return []
+        tag, value = line.split(':', 1)
+        tag, value = tag.strip(), value.strip()
+
+        if value.startswith('<text>'):
+            value = value[len('<text>'):]
+            if '</text>' not in value:
+                self._text_tag = tag
+                self._text = [value]
+                return []
+            value = value.split('</text>', 1)[0]
+
+        # A new file, package or snippet section ends the current file
+        if tag in ('FileName', 'PackageName', 'SnippetSPDXID',
+                'LicenseID'):
+            records = self._emit()
+            if tag == 'FileName':
+                filename = value[2:] if value.startswith('./') else value
+                self._file = (filename, [], [])
+            return records
+
+        self._store(tag, value)
+        return []
+
+    def finish(self):
+        return self._emit()
+
+
+class DEP5Parser(_LineParser):
+    '''Incremental parser for Debian machine-readable copyright (dep5)
+
+    A record is produced for every path listed in a Files paragraph.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self._fields = {}
+        self._field = None
+
+    def _emit(self):
+        fields, self._fields, self._field = self._fields, {}, None
+        if 'Files' not in fields:
+            return []
+
+        filenames = ' '.join(fields['Files']).split()
+        # The first line of a License field holds the short name,
+        #   anything following it is the license text
+        licenses = _licenses(fields.get('License', [''])[:1])
+        copyrights = _unique(fields.get('Copyright', []))
+        return [FileRecord(filename, licenses, copyrights)
+                for filename in filenames]
+
+    def parse_line(self, line):
+        if not line.strip():
+            return self._emit()
+
+        if line[0] in ' \t':
+            if self._field is not None:
+                value = line.strip()
+                if value != '.':
+                    self._fields[self._field].append(value)
+            return []
+
+        if ':' in line:
+            field, value = line.split(':', 1)
+            self._field = field.strip()
+            self._fields[self._field] = [value.strip()] \
+                    if value.strip() else []
+        return []
+
+    def finish(self):
+        return self._emit()
+
+
+def _local_name(tag):
+    '''Strips the namespace from an ElementTree tag'''
+    return tag.rsplit('}', 1)[-1]
+
+
+def _rdf_attribute(element, name):
+    for key, value in element.attrib.items():
+        if _local_name(key) == name:
+            return value
+    return None
+
+
+def _license_ids(element):
+    '''Returns the license ids referenced by an RDF license property'''
+    resource = _rdf_attribute(element, 'resource')
+    if resource:
+        return [resource.rsplit('#', 1)[-1].rsplit('/', 1)[-1]]
+
+    ids = []
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 'licenseId' and child.text:
+            return [child.text]
+        # Exceptions of a WithExceptionOperator are not licenses
+        if name == 'licenseException':
+            continue
+        ids.extend(_license_ids(child))
+
+    if not ids:
+        about = _rdf_attribute(element, 'about')
+        if about:
+            ids.append(about.rsplit('#', 1)[-1].rsplit('/', 1)[-1])
+        elif element.text and element.text.strip():
+            ids.append(element.text.strip())
+    return ids
+
+
+class SPDXRDFParser():
+    '''Incremental parser for SPDX RDF/XML reports (spdx2)
+
+    Every element is detached from its parent once it has ended,
+        unless it is part of a File still being read, so only the
+        current path through the document is kept in memory.
+    '''
+
+    def __init__(self):
+        self._parser = XMLPullParser(events=('start', 'end'))
+        self._open = []         # Elements started but not ended yet
+        self._files_open = 0
+
+    def _records(self):
+        records = []
+        for event, element in self._parser.read_events():
+            is_file = _local_name(element.tag) == 'File'
+            if event == 'start':
+                self._open.append(element)
+                if is_file:
+                    self._files_open += 1
+                continue
+
+            self._open.pop()
+            if is_file:
+                self._files_open -= 1
+                record = self._file_record(element)
+                if record is not None:
+                    records.append(record)
+
+            # Drop the parsed subtree to keep memory use flat
+            if not self._files_open and self._open:
+                self._open[-1].remove(element)
+        return records
+
+    @staticmethod
+    def _file_record(element):
+        filename = None
+        licenses = []
+        copyrights = []
+        for child in element:
+            name = _local_name(child.tag)
+            if name == 'fileName' and child.text:
+                filename = child.text.strip()
+            elif name in ('licenseInfoInFile', 'licenseConcluded'):
+                licenses.extend(_license_ids(child))
+            elif name == 'copyrightText' and child.text:
+                copyrights.extend(child.text.splitlines())
+
+        if filename is None:
+            return None
+        if filename.startswith('./'):
+            filename = filename[2:]
+        return FileRecord(filename, _licenses(licenses), _unique(copyrights))
+
+    def feed(self, data):
+        '''Parses a chunk of the report, returns any completed records'''
+        self._parser.feed(data)
+        return self._records()
+
+    def close(self):
+        '''Signals the end of the report, returns the remaining records'''
+        self._parser.close()
+        return self._records()
+
+
+# Parsers for the FOSSology report formats that carry per-file findings
+PARSERS = {
+        'spdx2tv': SPDXTagValueParser,
+        'spdx2': SPDXRDFParser,
+        'dep5': DEP5Parser,
+        }
+
+
+def iter_records(chunks, report_format):
+    '''Yields a FileRecord for each file as the report chunks arrive'''
+    try:
+        parser = PARSERS[report_format]()
+    except KeyError:
+        raise ValueError('No parser for report format: {}'.format(
+            report_format))
+
+    for chunk in chunks:
+        for record in parser.feed(chunk):
+            yield record
+    for record in parser.close():
+        yield record
@@ -0,0 +1,382 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# The profiler collecting timings, None while profiling is off
+_active = None
+
+_local = threading.local()
+
+PHASES = ('server', 'transfer', 'decode', 'build')
+
+
+class _Call():
+    '''Timings of a single profiled call'''
+
+    def __init__(self, endpoint, start):
+        self.endpoint = endpoint
+        self.start = start
+        self.duration = None
+        self.thread_id = threading.get_ident()
+        self.phases = []        # (phase, start, duration)
+
+    def add_phase(self, phase, start, duration):
+        self.phases.append((phase, start, duration))
+
+    def phase_totals(self):
+        totals = dict.fromkeys(PHASES, 0.0)
+        for phase, _, duration in self.phases:
+            totals[phase] += duration
+        # Whatever the connection did not account for was spent
+        #   in the client, mostly building resource objects
+        totals['build'] = max(0.0, self.duration - sum(totals.values()))
+        return totals
+
+
+class _Attempt():
+    '''Timings of one of several copies of a request sent for a call
+
+    Phases are held back until the attempt is adopted, so copies of
+        a hedged request that lose the race don't add to the call.
+    '''
+
+    def __init__(self, call):
+        self.call = call
+        self.phases = []
+        self.adopted = False
+        self._lock = threading.Lock()
+
+    def add_phase(self, phase, start, duration):
+        with self._lock:
+            if not self.adopted:
+                self.phases.append((phase, start, duration))
+                return
+        self.call.add_phase(phase, start, duration)
+
+    def adopt(self):
+        '''Adds the phases, including any later ones, to the call'''
+        with self._lock:
+            self.adopted = True
+            phases, self.phases = self.phases, []
+        for phase in phases:
+            self.call.add_phase(*phase)
+
+
+class _TimedUpload():
+    '''Request body iterator that times how long its chunks take to send
+
+    Time spent producing the chunks, such as compressing an archive,
+        is left to the build phase.
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.start = None
+        self.sending = 0.0
+        self.finished = None
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yielded = time.perf_counter()
+            if self.start is None:
+                self.start = yielded
+            yield chunk
+            self.sending += time.perf_counter() - yielded
+        self.finished = time.perf_counter()
+
+
+class _TimedBody():
+    '''Times the reads of a streamed response body
+
+    Both read() and stream() are timed, as chunked bodies are streamed
+        without going through read(). The transfer phase is added to
+        the call once the body has been read or closed, and a call
+        made outside any profiled method is recorded then.
+    '''
+
+    def __init__(self, profiler, call, standalone, raw):
+        self.profiler = profiler
+        self.call = call
+        self.standalone = standalone
+        self.start = None
+        self.reading = 0.0
+        self.done = False
+        self._busy = False
+
+        self._read = raw.read
+        self._stream = raw.stream
+        self._close = raw.close
+        self._release_conn = raw.release_conn
+        raw.read = self.read
+        raw.stream = self.stream
+        raw.close = self.close
+        # Fully read responses are released rather than closed
+        raw.release_conn = self.release_conn
+
+    def _timed(self, func, *args, **kwargs):
+        if self._busy:
+            # A read made by stream(), which is already timed
+            return func(*args, **kwargs)
+
+        start = time.perf_counter()
+        if self.start is None:
+            self.start = start
+        # urllib3 releases the connection from within the last read
+        self._busy = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._busy = False
+            self.reading += time.perf_counter() - start
+            if self.done is None:
+                self.finish()
+
+    def read(self, *args, **kwargs):
+        data = self._timed(self._read, *args, **kwargs)
+        if not data:
+            self.finish()
+        return data
+
+    def stream(self, *args, **kwargs):
+        chunks = self._stream(*args, **kwargs)
+        while True:
+            try:
+                chunk = self._timed(next, chunks)
+            except StopIteration:
+                break
+            yield chunk
+        self.finish()
+
+    def close(self):
+        self.finish()
+        return self._close()
+
+    def release_conn(self):
+        self.finish()
+        return self._release_conn()
+
+    def finish(self):
+        if self._busy:
+            # Finished once the read returns
+            self.done = None
+            return
+        if self.done:
+            return
+        self.done = True
+        if self.start is not None:
+            self.call.add_phase('transfer', self.start, self.reading)
+        if self.standalone:
+            self.call.duration = time.perf_counter() - self.call.start
+            self.profiler._record(self.call)
+
+
+class Profiler():
+    '''Collects per-call timing phases of the client
+
+    Phases recorded for every call:
+        server   -- from sending the request, or the end of a streamed
+                    request body, until the response headers arrived,
+                    including connection and TLS setup
+        transfer -- sending a streamed request body and reading the
+                    response body
+        decode   -- decoding the JSON body
+        build    -- the rest of the call, mostly building objects
+                    and producing streamed request bodies
+    '''
+
+    def __init__(self):
+        self.calls = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _record(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def send(self, session, prepared_request, call=None, stream=False,
+            **kwargs):
+        '''Sends a request through session, timing each phase
+
+        Phases are added to call, by default the profiled call running
+            in this thread. With stream, the body of the response is
+            left unread and timed while the caller reads it. Other
+            arguments are passed to session.send.
+        '''
+        call = call or current_call()
+        if call is not None:
+            standalone = False
+        else:
+            # Connection used directly, outside any profiled method
+            call = _Call('{} {}'.format(prepared_request.method,
+                prepared_request.path_url.split('?')[0]),
+                time.perf_counter())
+            standalone = True
+
+        upload = None
+        body = prepared_request.body
+        if body is not None and \
+                not isinstance(body, (bytes, str, list, tuple, dict)):
+            upload = prepared_request.body = _TimedUpload(body)
+
+        start = time.perf_counter()
+        response = session.send(prepared_request, stream=True, **kwargs)
+        received = time.perf_counter()
+        if upload is not None and upload.finished is not None:
+            if upload.start is not None:
+                call.add_phase('transfer', upload.start, upload.sending)
+            start = upload.finished
+        call.add_phase('server', start, received - start)
+
+        if stream:
+            _TimedBody(self, call, standalone, response.raw)
+            return response
+
+        response.content
+        transferred = time.perf_counter()
+        call.add_phase('transfer', received, transferred - received)
+
+        if 'json' in response.headers.get('Content-Type', ''):
+            try:
+                data = response.json()
+            except ValueError:
+                pass
+            else:
+                decoded = time.perf_counter()
+                call.add_phase('decode', transferred, decoded - transferred)
+                # Callers get the already decoded body
+                response.json = lambda **kwargs: data
+
+        if standalone:
+            call.duration = time.perf_counter() - call.start
+            self._record(call)
+        return response
+
+    def stats(self):
+        '''Returns aggregated timings per endpoint
+
+        Maps each endpoint to a dict with the number of calls, the
+            total time and the total time of each phase, in seconds.
+        '''
+        stats = {}
+        with self._lock:
+            calls = list(self.calls)
+
+        for call in calls:
+            entry = stats.setdefault(call.endpoint,
+                    dict(dict.fromkeys(PHASES, 0.0), calls=0, total=0.0))
+            entry['calls'] += 1
+            entry['total'] += call.duration
+            for phase, duration in call.phase_totals().items():
+                entry[phase] += duration
+        return stats
+
+    def report(self, sort='total'):
+        '''Returns a table of the aggregated timings, sorted by a column
+
+        sort can be 'calls', 'total', 'mean' or any of the phases.
+        '''
+        stats = self.stats()
+        for entry in stats.values():
+            entry['mean'] = entry['total'] / entry['calls']
+
+        columns = ('calls', 'total', 'mean') + PHASES
+        rows = sorted(stats.items(), key=lambda item: item[1][sort],
+                reverse=True)
+
+        width = max([len('endpoint')] + [len(name) for name in stats])
+        lines = ['{:<{}}'.format('endpoint', width) +
+                ''.join('{:>10}'.format(column) for column in columns)]
+        for endpoint, entry in rows:
+            line = '{:<{}}{:>10}'.format(endpoint, width, entry['calls'])
+            line += ''.join('{:>10.4f}'.format(entry[column])
+                    for column in columns[1:])
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def trace_events(self):
+        '''Returns the calls as Chrome trace events'''
+        pid = os.getpid()
+        events = []
+
+        def event(name, start, duration, tid, args=None):
+            events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self._origin) * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': tid,
+                'args': args or {},
+                })
+
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            event(call.endpoint, call.start, call.duration, call.thread_id,
+                    call.phase_totals())
+            for phase, start, duration in call.phases:
+                event(phase, start, duration, call.thread_id)
+        return events
+
+    def dump_trace(self, path):
+        '''Writes the calls to a file loadable by chrome://tracing'''
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events()}, f)
+
+
+def current_call():
+    '''Returns the profiled call running in this thread, if any'''
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def profile(profiler=None):
+    '''Profiles all client calls made inside the block
+
+    Yields the Profiler collecting the timings.
+    '''
+    global _active
+
+    profiler = profiler or Profiler()
+    previous, _active = _active, profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+
+
+def profiled(func):
+    '''Records calls to a client method while profiling is on
+
+    Only the outermost profiled method of a call is recorded, so
+        methods delegating to other methods are not counted twice.
+    '''
+    endpoint = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _active
+        if profiler is None:
+            return func(*args, **kwargs)
+
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            return func(*args, **kwargs)
+
+        call = _Call(endpoint, time.perf_counter())
+        stack.append(call)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stack.pop()
+            call.duration = time.perf_counter() - call.start
+            profiler._record(call)
+
+    return wrapper
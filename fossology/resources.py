@@ -1,13 +1,15 @@
+from fossology import parsers, profiling, utils
 from fossology.exceptions import FossologyError,\
         FossologyInvalidCredentialsError
 
 
 
+@profiling.profiled
 def job(job_id, connection):
     '''Gets a single job from the server'''
     endpoint_fragments = ['jobs', job_id]
 
-    headers = {'Content-Type': 'application/json'}
+    headers = utils.JSON_HEADERS
 
     # request job data
     server_response = connection.get(
@@ -25,13 +27,16 @@ def job(job_id, connection):
                 upload_id = response_data['uploadId'],
                 user_id = response_data['userId'],
                 group_id = response_data['groupId'],
+                eta = response_data.get('eta'),
+                status = response_data.get('status'),
                 connection = connection)
 
+@profiling.profiled
 def folder(folder_id, connection):
     '''Gets a single folder from the server'''
     endpoint_fragments = ['folders', folder_id]
 
-    headers = {'Content-Type': 'application/json'}
+    headers = utils.JSON_HEADERS
 
     # request folder data
     server_response =connection.get(
@@ -72,6 +77,7 @@ class Upload():
         self._endpoint_fragment = 'uploads'
 
 
+    @profiling.profiled
     def delete(self):
         '''Delete an upload'''
         url_fragments = [self._endpoint_fragment, self.upload_id]
@@ -85,6 +91,7 @@ class Upload():
 
 
 
+    @profiling.profiled
     def move(self, destination_folder):
         '''Move an upload to another folder'''
         url_fragments = [self._endpoint_fragment, self.upload_id]
@@ -101,6 +108,7 @@ class Upload():
             self.folder_name = destination_folder.folder_name
             return True
 
+    @profiling.profiled
     def copy(self, destination_folder):
         '''Move an upload to another folder'''
         url_fragments = [self._endpoint_fragment, self.upload_id]
@@ -114,13 +122,14 @@ class Upload():
         response_code = server_response.status_code
         return response_code == 202     # Accepted
 
+    @profiling.profiled
     def schedule_agents(self, agents):
         '''Schedule agents on this upload'''
         url_fragments = ['jobs']
 
-        headers = {'Content-Type': 'application/json',
-                    'folderId':self.folder_id,
-                    'uploadId':self.upload_id}
+        headers = dict(utils.JSON_HEADERS,
+                    folderId=self.folder_id,
+                    uploadId=self.upload_id)
 
         # request the server to schedule an analysis
         server_response = self.connection.post(
@@ -140,6 +149,7 @@ class Upload():
                     response_data['type'])
 
 
+    @profiling.profiled
     def request_report_generation(self, reportFormat):
         '''Request a report to be generated for this upload'''
         url_fragments = ['report']
@@ -147,9 +157,11 @@ class Upload():
         headers = {'uploadId': str(self.upload_id),
                     'reportFormat':reportFormat}
 
-        # request report generation
+        # request report generation, which must reach the server
+        #   once per call even though it is a GET
         server_response = self.connection.get(
-                url_fragments=url_fragments, headers=headers)
+                url_fragments=url_fragments, headers=headers,
+                coalesce=False)
 
         response_code = server_response.status_code
         if response_code == 201:
@@ -182,6 +194,7 @@ class Folder():
         self._endpoint_fragment = 'folders'
 
 
+    @profiling.profiled
     def create_child_folder(self, folder_name,
             folder_description=None):
         '''Create a new folder inside the current folder'''
@@ -209,6 +222,7 @@ class Folder():
                     response_data['type'])
 
 
+    @profiling.profiled
     def delete(self):
         '''Delete a folder'''
         url_fragments = [self._endpoint_fragment, self.folder_id]
@@ -221,6 +235,7 @@ class Folder():
         return response_code == 202     # Accepted
 
 
+    @profiling.profiled
     def move(self, parent_folder):
         '''Move a folder under a new parent'''
         url_fragments = [self._endpoint_fragment, self.folder_id]
@@ -235,6 +250,7 @@ class Folder():
         response_code = server_response.status_code
         return response_code == 202     # Accepted
 
+    @profiling.profiled
     def copy(self, parent_folder):
         '''Copy a folder under another parent'''
         url_fragments = [self._endpoint_fragment, self.folder_id]
@@ -249,6 +265,7 @@ class Folder():
         response_code = server_response.status_code
         return response_code == 202     # Accepted
 
+    @profiling.profiled
     def rename(self, new_name):
         '''Rename a folder'''
         url_fragments = [self._endpoint_fragment, self.folder_id]
@@ -264,6 +281,7 @@ class Folder():
             self.folder_name = new_name
             return True
 
+    @profiling.profiled
     def edit_description(self, new_description):
         '''Modify a folder's description'''
         url_fragments = [self._endpoint_fragment, self.folder_id]
@@ -298,6 +316,7 @@ class User():
         self._endpoint_fragment = 'users'
 
 
+    @profiling.profiled
     def delete(self):
         '''Delete a user'''
         url_fragments = [self._endpoint_fragment, self.user_id]
@@ -314,13 +333,15 @@ class Job():
     '''Denotes a single job on the server'''
 
     def __init__(self, job_id, name, queueDate, upload_id,
-            user_id, group_id, connection):
+            user_id, group_id, connection, eta=None, status=None):
         self.job_id=job_id
         self.name=name
         self.queueDate=queueDate
         self.upload_id=upload_id   # TODO: make this Upload object
         self.user_id=user_id       # TODO: make this a User object
         self.group_id=group_id
+        self.eta=eta
+        self.status=status
         self.connection=connection
 
         self._endpoint_fragment = 'jobs'
@@ -337,12 +358,46 @@ class Report():
         self._endpoint_fragment = 'report'
 
 
+    @profiling.profiled
     def download(self, filename=None):
         '''Downloads a generated report'''
         url_fragments = [self._endpoint_fragment, self.report_id]
 
         return self.connection.download_file(url_fragments, filename)
 
+    def iter_content(self, chunk_size=65536):
+        '''Yields the generated report as chunks of bytes
+
+        Nothing is written to disk. The connection is released once
+            the report has been read or the iterator is closed.
+        '''
+        url_fragments = [self._endpoint_fragment, self.report_id]
+
+        with self.connection.open_stream(url_fragments) as response:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield chunk
+
+    def open(self):
+        '''Returns the generated report as a readable file-like object
+
+        The caller is responsible for closing it.
+        '''
+        url_fragments = [self._endpoint_fragment, self.report_id]
+
+        response = self.connection.open_stream(url_fragments)
+        # Undo any transfer compression while reading
+        response.raw.decode_content = True
+        return response.raw
+
+    def iter_records(self, chunk_size=65536):
+        '''Yields per-file license and copyright findings
+
+        Records are parsed incrementally while the report downloads.
+            Supported for the spdx2, spdx2tv and dep5 formats.
+        '''
+        return parsers.iter_records(self.iter_content(chunk_size),
+                self.reportFormat)
+
 
 class SearchResult():
     '''Denotes a single search result'''
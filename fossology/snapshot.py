@@ -0,0 +1,114 @@
+import json
+import time
+from collections import namedtuple
+
+from fossology import utils
+
+
+# A user joined with their root folder and number of jobs
+UserRecord = namedtuple('UserRecord', ['user_id', 'name', 'description',
+    'email', 'access_level', 'root_folder_id', 'root_folder_name',
+    'email_notification', 'agents', 'job_count'])
+
+
+class AccessSnapshot():
+    '''Point in time view of users, their root folders and job counts
+
+    Built from three bulk calls (get_all_users, get_all_folders and
+        get_all_jobs) instead of a round trip per user, and indexed by
+        access level, root folder and agent settings for audits.
+    '''
+
+    def __init__(self, users, taken_at=None):
+        self.taken_at = taken_at or time.time()
+        self.users = {user.user_id: user for user in users}
+
+        self._by_access_level = {}
+        self._by_root_folder = {}
+        self._by_agent = {}
+        for user in users:
+            self._by_access_level.setdefault(user.access_level,
+                    set()).add(user.user_id)
+            self._by_root_folder.setdefault(user.root_folder_id,
+                    set()).add(user.user_id)
+            if isinstance(user.agents, dict):
+                for agent, setting in user.agents.items():
+                    if isinstance(setting, (dict, list)):
+                        continue
+                    self._by_agent.setdefault((agent, setting),
+                            set()).add(user.user_id)
+
+    @classmethod
+    def load(cls, fossology):
+        '''Takes a snapshot from the server'''
+        folders = {str(folder.folder_id): folder
+                for folder in fossology.get_all_folders()}
+
+        job_counts = {}
+        for job in fossology.get_all_jobs():
+            job_counts[str(job.user_id)] = \
+                    job_counts.get(str(job.user_id), 0) + 1
+
+        users = []
+        for user in fossology.get_all_users():
+            root_folder = folders.get(str(user.rootFolderId))
+            users.append(UserRecord(
+                user_id = user.user_id,
+                name = user.name,
+                description = user.description,
+                email = user.email,
+                access_level = user.accessLevel,
+                root_folder_id = user.rootFolderId,
+                root_folder_name = root_folder.folder_name
+                        if root_folder is not None else None,
+                email_notification = user.emailNotification,
+                agents = user.agents,
+                job_count = job_counts.get(str(user.user_id), 0)))
+
+        return cls(users)
+
+    def save(self, path):
+        '''Writes the snapshot to a JSON file'''
+        utils._write_json(path, {
+            'taken_at': self.taken_at,
+            'users': [user._asdict() for user in self.users.values()],
+            })
+
+    @classmethod
+    def from_file(cls, path):
+        '''Reads a snapshot written by save()'''
+        with open(path) as f:
+            data = json.load(f)
+        return cls([UserRecord(**user) for user in data['users']],
+                taken_at=data['taken_at'])
+
+    def user(self, user_id):
+        '''Returns the UserRecord of a user, or None'''
+        return self.users.get(user_id)
+
+    def query(self, access_level=None, root_folder_id=None, agents=None):
+        '''Returns the users matching all of the given criteria
+
+        agents is a dict of agent settings, such as {'monk': True},
+            that users must all have.
+        '''
+        matches = None
+
+        def narrow(user_ids):
+            return set(user_ids) if matches is None else matches & user_ids
+
+        if access_level is not None:
+            matches = narrow(self._by_access_level.get(access_level, set()))
+        if root_folder_id is not None:
+            matches = narrow(self._by_root_folder.get(root_folder_id, set()))
+        for agent, setting in (agents or {}).items():
+            matches = narrow(self._by_agent.get((agent, setting), set()))
+
+        if matches is None:
+            matches = self.users.keys()
+        return [self.users[user_id] for user_id in sorted(matches)]
+
+    def access_levels(self):
+        '''Returns the number of users for each access level'''
+        return {level: len(user_ids)
+                for level, user_ids in self._by_access_level.items()}
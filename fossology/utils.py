@@ -1,10 +1,27 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from posixpath import join
-from requests import Request, Session
+from types import MappingProxyType
+from requests import PreparedRequest, Request, Session
+from requests.exceptions import Timeout
+from requests.structures import CaseInsensitiveDict
+from requests.utils import check_header_validity
+from urllib.parse import quote
 from uuid import uuid4
 import cgi
+import copy
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
 
 
-from fossology.exceptions import FossologyError, FossologyResourceNotReadyError
+from fossology import profiling
+from fossology.exceptions import FossologyError, \
+        FossologyResourceNotReadyError, FossologyTimeoutError, \
+        FossologyCancelledError
 
 
 def _join_url(base_url, *fragments):
@@ -17,81 +34,702 @@ def _join_url(base_url, *fragments):
 
     return join(base_url, *fragments)
 
+# Headers sent with most requests to the REST API. Read only, as it
+#   is shared by all of them; extend a copy with dict(JSON_HEADERS, ...)
+JSON_HEADERS = MappingProxyType({'Content-Type': 'application/json'})
+
+# Characters left as they are when filling in URL fragments
+_URL_SAFE = "!#$%&'()*+,/:;=?@[]~"
+
+# Request arguments that templates know how to fill in
+_TEMPLATE_ARGUMENTS = frozenset(('headers', 'data', 'files', 'json'))
+
+# Seconds a request may wait on the server before it times out
+DEFAULT_TIMEOUT = 60
+
+# Latency samples kept per endpoint, and needed before hedging starts
+_LATENCY_SAMPLES = 100
+_MIN_LATENCY_SAMPLES = 20
+
+_local = threading.local()
+
+# Connections recreated by pickle in this process, by configuration
+_shared_connections = {}
+_shared_connections_lock = threading.Lock()
+
+
 def _generate_unique_name():
     '''Generates a unique ID'''
 
     return str(uuid4())
 
+def _write_json(path, data):
+    '''Writes JSON to a file atomically'''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def _multipart_body(field_name, filename, chunks, boundary):
+    '''Yields a multipart/form-data body with a single file field'''
+    yield ('--{}\r\n'
+            'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n').format(
+                    boundary, field_name, filename).encode()
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+    yield '\r\n--{}--\r\n'.format(boundary).encode()
+
+
+def _active_deadlines():
+    '''Returns the deadlines applying to the current thread'''
+    return getattr(_local, 'deadlines', None) or ()
+
+
+class _StreamGuard():
+    '''Ends a streamed response body when a deadline ends
+
+    Reads check the deadlines, and a read waiting on the server is
+        interrupted by shutting down the socket once a deadline is
+        cancelled or passes. Both read() and stream() are guarded, as
+        chunked bodies are streamed without going through read(), so
+        an interrupted body raises the error of the deadline rather
+        than a broken connection error.
+    '''
+
+    def __init__(self, raw, deadlines):
+        self.raw = raw
+        self.deadlines = deadlines
+        self.done = False
+        self._lock = threading.Lock()
+
+        self._read = raw.read
+        self._stream = raw.stream
+        self._close = raw.close
+        self._release_conn = raw.release_conn
+        raw.read = self.read
+        raw.stream = self.stream
+        raw.close = self.close
+        raw.release_conn = self.release_conn
+
+        for deadline in deadlines:
+            deadline._add_waiter(self)
+
+        self._timer = None
+        expires = [deadline.expires for deadline in deadlines
+                if deadline.expires is not None]
+        if expires:
+            self._timer = threading.Timer(
+                    max(0.0, min(expires) - time.monotonic()), self.set)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def check(self):
+        for deadline in self.deadlines:
+            deadline.check()
+
+    def read(self, *args, **kwargs):
+        self.check()
+        try:
+            return self._read(*args, **kwargs)
+        finally:
+            # A read cut short by the deadline raises its error
+            self.check()
+
+    def stream(self, *args, **kwargs):
+        chunks = self._stream(*args, **kwargs)
+        while True:
+            self.check()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            except Exception:
+                self.check()
+                raise
+            yield chunk
+
+    def set(self):
+        '''Interrupts the response, called when a deadline ends'''
+        with self._lock:
+            if self.done:
+                return
+            connection = getattr(self.raw, '_connection', None)
+            sock = getattr(connection, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def finish(self):
+        # The connection may be reused once released, so it must
+        #   not be shut down anymore
+        with self._lock:
+            self.done = True
+        for deadline in self.deadlines:
+            deadline._remove_waiter(self)
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def close(self):
+        self.finish()
+        return self._close()
+
+    def release_conn(self):
+        self.finish()
+        return self._release_conn()
+
+
+def _close_response(future):
+    '''Releases the connection of a response nobody is waiting for'''
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class Deadline():
+    '''Time limit and cancellation for the requests made in a block
+
+    Used as a context manager, it applies to every request the current
+        thread sends through a Connection until the block ends, so a
+        single deadline covers operations made of several requests.
+        Deadlines can be nested, the earliest one wins.
+
+    cancel() may be called from any thread. Requests of the block that
+        are waiting on the server are abandoned, and they and any later
+        requests raise FossologyCancelledError. Requests running past
+        the deadline raise FossologyTimeoutError.
+
+    Uploads are abandoned like other requests while they wait for the
+        response, but a request body that is being sent is not
+        interrupted. A streamed download started in the block, such
+        as Report.download, Report.iter_content or Report.open, is
+        abandoned as soon as the deadline is cancelled or has passed,
+        even while its body is still being read.
+    '''
+
+    def __init__(self, seconds=None):
+        self.expires = None if seconds is None \
+                else time.monotonic() + seconds
+
+        self._cancelled = False
+        self._waiters = set()
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        '''Returns the seconds left, or None without a time limit'''
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        '''Abandons all requests made under this deadline'''
+        with self._lock:
+            self._cancelled = True
+            waiters = list(self._waiters)
+        for waiter in waiters:
+            waiter.set()
+
+    def check(self):
+        '''Raises if the deadline was cancelled or has passed'''
+        if self._cancelled:
+            raise FossologyCancelledError()
+        if self.expires is not None and time.monotonic() >= self.expires:
+            raise FossologyTimeoutError('Deadline exceeded.')
+
+    def _add_waiter(self, event):
+        with self._lock:
+            self._waiters.add(event)
+            if self._cancelled:
+                event.set()
+
+    def _remove_waiter(self, event):
+        with self._lock:
+            self._waiters.discard(event)
+
+    def __enter__(self):
+        if not hasattr(_local, 'deadlines'):
+            _local.deadlines = []
+        _local.deadlines.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.deadlines.remove(self)
+
+
+def _wait(event, deadlines, until=None):
+    '''Waits for event until the earliest deadline or until'''
+    times = [expires for expires in
+            [until] + [deadline.expires for deadline in deadlines]
+            if expires is not None]
+    timeout = None
+    if times:
+        timeout = max(0.0, min(times) - time.monotonic())
+    event.wait(timeout)
+    event.clear()
+
+
+def _follower_error(error):
+    '''Returns the exception raised by a caller that shared a failed GET
+
+    Each caller raises its own copy, so tracebacks don't pile up on
+        one exception object raised in several threads.
+    '''
+    if not isinstance(error, Exception):
+        # The caller sending the request was interrupted
+        return FossologyCancelledError('Shared request was aborted.')
+    try:
+        return copy.copy(error)
+    except Exception:
+        return FossologyError(None, str(error), 'ERROR')
+
+
+class _Flight():
+    '''A GET request in progress that other callers can wait on'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    def add_waiter(self, event):
+        with self._lock:
+            if self.done.is_set():
+                event.set()
+            else:
+                self._waiters.append(event)
+
+    def finish(self):
+        with self._lock:
+            self.done.set()
+            waiters = self._waiters
+        for waiter in waiters:
+            waiter.set()
+
+
+class _Headers(CaseInsensitiveDict):
+    '''Session headers that count their modifications
+
+    Lets request templates tell when their merged headers are stale.
+    '''
+    version = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+
+class RequestTemplate():
+    '''Precompiled requests for one method and endpoint
+
+    The URL prefix is joined once, and the session headers merged
+        with the headers of a call are validated and cached, so
+        preparing a request only fills in the variable URL fragments
+        and copies the headers. Headers set to None are left out.
+
+    Templates are shared by all threads using the connection.
+    '''
+
+    # Number of distinct header sets remembered per template
+    max_cached_headers = 64
+
+    def __init__(self, session, method, prefix):
+        self.session = session
+        self.method = method
+        self.prefix = prefix
+
+        self._headers = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _merged_headers(self, headers):
+        session_headers = self.session.headers
+        version = session_headers.version
+        key = tuple(headers.items()) if headers else ()
+
+        with self._lock:
+            if self._version != version:
+                self._headers.clear()
+                self._version = version
+            merged = self._headers.get(key)
+        if merged is not None:
+            return merged
+
+        merged = CaseInsensitiveDict()
+        for header in session_headers.items():
+            if header[1] is not None:
+                check_header_validity(header)
+                merged[header[0]] = header[1]
+        for header in key:
+            if header[1] is None:
+                merged.pop(header[0], None)
+            else:
+                check_header_validity(header)
+                merged[header[0]] = header[1]
+
+        with self._lock:
+            # Headers merged before the session headers changed are
+            #   not cached
+            if self._version == version:
+                if len(self._headers) >= self.max_cached_headers:
+                    self._headers.popitem(last=False)
+                self._headers[key] = merged
+        return merged
+
+    def prepare(self, fragments=(), headers=None, data=None, files=None,
+            json=None):
+        '''Returns a PreparedRequest for the given URL fragments'''
+        url = self.prefix
+        if fragments:
+            url += '/' + quote('/'.join([str(i) for i in fragments]),
+                    safe=_URL_SAFE)
+
+        prepared_request = PreparedRequest()
+        prepared_request.method = self.method
+        prepared_request.url = url
+        prepared_request.headers = self._merged_headers(headers).copy()
+        prepared_request.prepare_cookies(self.session.cookies)
+        prepared_request.prepare_body(data, files, json)
+        prepared_request.prepare_hooks(self.session.hooks)
+        return prepared_request
+
+
+def _shared_connection(config, headers):
+    '''Returns this process' connection for a pickled configuration
+
+    Every object unpickled with the same configuration shares one
+        connection, and with it one pool of open sockets. Connections
+        inherited from a forked parent are never reused, since their
+        sockets belong to the parent.
+    '''
+    key = (os.getpid(), tuple(sorted(config.items())),
+            tuple(sorted(headers.items())))
+    with _shared_connections_lock:
+        connection = _shared_connections.get(key)
+        if connection is None:
+            connection = _shared_connections[key] = Connection(**config)
+            connection.headers.update(headers)
+    return connection
+
 
 class Connection():
-    def __init__(self, server):
+    '''Session with the REST API of a FOSSology server
+
+    timeout is the default time limit in seconds for a single request
+        to connect and for each wait on the server, DEFAULT_TIMEOUT
+        unless given. None lets requests wait forever.
+
+    If hedge_percentile is set, a GET that takes longer than that
+        percentile of recent latencies of GETs of the same resource and
+        URL depth (so single items and listings are apart) is sent a
+        second time, and whichever response arrives first is used. At
+        most hedge_budget (a fraction) of GETs are sent twice.
+    '''
+
+    def __init__(self, server, timeout=DEFAULT_TIMEOUT,
+            hedge_percentile=None, hedge_budget=0.05, max_workers=16):
         self.server = server
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.max_workers = max_workers
 
         self.session = Session()
+        self.session.headers = _Headers(self.session.headers)
         self.headers = self.session.headers
 
-    def upload_file(self, url_fragments, file, *args, **kwargs):
-
-        url = _join_url(self.server, *url_fragments)
+        # Request templates, by method and first URL fragment
+        self._templates = {}
+
+        # Identical GETs in flight, shared by concurrent callers
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self.coalesce_stats = {'sent': 0, 'coalesced': 0}
+
+        # Recent GET latencies by endpoint and URL depth, for hedging
+        self._latencies = {}
+        self._hedge_lock = threading.Lock()
+        self.hedge_stats = {'requests': 0, 'hedged': 0}
+
+        # Threads for requests that may be abandoned or hedged
+        self._executor = None
+
+    def __reduce__(self):
+        # Sessions can't be pickled, so only the configuration and
+        #   headers (including the auth token) are sent along
+        config = {'server': self.server,
+                'timeout': self.timeout,
+                'hedge_percentile': self.hedge_percentile,
+                'hedge_budget': self.hedge_budget,
+                'max_workers': self.max_workers}
+        return (_shared_connection, (config, dict(self.headers)))
+
+    def _timeout(self, timeout, deadlines):
+        '''Returns the time limit for a request under the deadlines'''
+        for deadline in deadlines:
+            deadline.check()
+
+        timeout = self.timeout if timeout is None else timeout
+        for deadline in deadlines:
+            remaining = deadline.remaining()
+            if remaining is not None and \
+                    (timeout is None or remaining < timeout):
+                timeout = remaining
+        return timeout
+
+    def upload_file(self, url_fragments, file, *args, timeout=None,
+            **kwargs):
 
         with open(file, 'rb') as fi:
-            response = self.session.post(url,
-                            files={'fileInput':fi},
-                            *args, **kwargs)
-        response_code = response.status_code
+            prepared_request = self._prepare('POST', url_fragments,
+                    files={'fileInput':fi}, *args, **kwargs)
+        return(self._send_request(prepared_request, timeout))
 
-        # Raise an error if the request was not successful
-        if 400 <= response_code <=599 :
-            response_data = response.json()
-            raise FossologyError(response_code,
-                    response_data.get('message'),
-                    response_data.get('type'))
+    def upload_stream(self, url_fragments, chunks, filename,
+            headers=None, *args, timeout=None, **kwargs):
+        '''Uploads a file whose content is produced by an iterator
 
-        return response
+        The multipart body is sent with chunked transfer encoding,
+            so the content never has to exist as a whole
+        '''
+        boundary = uuid4().hex
 
-    def download_file(self, url_fragments, filename=None,
-            *args, **kwargs):
-        '''Downloads a file
+        headers = dict(headers or {})
+        headers['Content-Type'] = \
+                'multipart/form-data; boundary={}'.format(boundary)
 
-        Returns a filename if successful, else throws an error
+        body = _multipart_body('fileInput', filename, chunks, boundary)
+
+        prepared_request = self._prepare('POST', url_fragments,
+                headers=headers, data=body, *args, **kwargs)
+        return(self._send_request(prepared_request, timeout))
+
+    def open_stream(self, url_fragments, *args, timeout=None, **kwargs):
+        '''Starts a streaming download
+
+        Returns the response with its body still unread, else throws
           - FossologyResourceNotReadyError if resource is not ready
           - FossologyError for any other error
         '''
-        url = _join_url(self.server, *url_fragments)
-        response = self.session.get(url, stream=True,
+        prepared_request = self._prepare('GET', url_fragments,
                 *args, **kwargs)
+        response = self._send(prepared_request, timeout, stream=True)
 
-        chunks = response.iter_content()
         response_code = response.status_code
         if response_code == 200:
+            deadlines = _active_deadlines()
+            if deadlines:
+                _StreamGuard(response.raw, list(deadlines))
+            return response
+
+        try:
+            if response_code == 503:
+                response_data = response.json()
+                raise FossologyResourceNotReadyError(response_code,
+                        response_data['message'],
+                        response_data['type'],
+                        response.headers.get('Retry-After'))
+            else:
+                raise FossologyError(response_code, None, None)
+        finally:
+            response.close()
+
+    def download_file(self, url_fragments, filename=None,
+            *args, **kwargs):
+        '''Downloads a file
+
+        Returns a filename if successful, else throws an error
+          - FossologyResourceNotReadyError if resource is not ready
+          - FossologyError for any other error
+        '''
+        with self.open_stream(url_fragments, *args, **kwargs) as response:
             # Try to extract the filename
             _,params = cgi.parse_header(
-                    response.headers.get('Content-Disposition'))
+                    response.headers.get('Content-Disposition', ''))
             filename = filename or params.get('filename','download')
 
             # Write the downloaded data to the file
             with open(filename, 'wb') as f:
-                for chunk in chunks:
+                for chunk in response.iter_content(chunk_size=65536):
                     f.write(chunk)
             return filename
 
-        elif response_code == 503:
-            response_data = response.json()
-            raise FossologyResourceNotReadyError(response_code,
-                    response_data['message'],
-                    response_data['type'],
-                    response.headers.get('Retry-After'))
+
+    def _prepare(self, method, url_fragments, *args, **kwargs):
+        '''Prepares a request, using a cached template when possible
+
+        Requests needing session auth, params or other arguments
+            are prepared by the session as usual.
+        '''
+        if args or not url_fragments or self.session.auth or \
+                self.session.params or \
+                not _TEMPLATE_ARGUMENTS.issuperset(kwargs):
+            url = _join_url(self.server, *url_fragments)
+            return self.session.prepare_request(
+                    Request(method=method, url=url, *args, **kwargs))
+
+        key = (method, url_fragments[0])
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates[key] = RequestTemplate(
+                    self.session, method,
+                    _join_url(self.server, url_fragments[0]))
+        return template.prepare(url_fragments[1:], **kwargs)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._hedge_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                            max_workers=self.max_workers)
+        return self._executor
+
+    def _hedge_delay(self, endpoint):
+        '''Returns how long to wait before hedging a GET, or None'''
+        samples = self._latencies.get(endpoint)
+        if self.hedge_percentile is None or samples is None or \
+                len(samples) < _MIN_LATENCY_SAMPLES:
+            return None
+        samples = sorted(samples)
+        return samples[int(self.hedge_percentile / 100 * (len(samples) - 1))]
+
+    def _record_latency(self, endpoint, seconds):
+        samples = self._latencies.get(endpoint)
+        if samples is None:
+            samples = self._latencies.setdefault(endpoint,
+                    deque(maxlen=_LATENCY_SAMPLES))
+        samples.append(seconds)
+
+    def _allow_hedge(self):
+        '''Takes a hedge from the budget, if any is left'''
+        with self._hedge_lock:
+            stats = self.hedge_stats
+            if stats['hedged'] + 1 > self.hedge_budget * stats['requests']:
+                return False
+            stats['hedged'] += 1
+            return True
+
+    def _send_once(self, prepped_request, timeout, call=None, stream=False):
+        profiler = profiling._active
+        try:
+            if profiler is None:
+                return self.session.send(prepped_request, timeout=timeout,
+                        stream=stream)
+            return profiler.send(self.session, prepped_request, call=call,
+                    stream=stream, timeout=timeout)
+        except Timeout:
+            raise FossologyTimeoutError()
+
+    def _send(self, prepped_request, timeout=None, endpoint=None,
+            stream=False):
+        '''Sends a prepared request within the current deadlines
+
+        endpoint is given for idempotent GETs, which may be hedged.
+            With stream, the response body is left unread.
+        '''
+        deadlines = _active_deadlines()
+        timeout = self._timeout(timeout, deadlines)
+
+        hedging = self.hedge_percentile is not None and endpoint is not None
+        delay = None
+        if hedging:
+            with self._hedge_lock:
+                self.hedge_stats['requests'] += 1
+            delay = self._hedge_delay(endpoint)
+
+        start = time.monotonic()
+        if not deadlines and delay is None:
+            response = self._send_once(prepped_request, timeout,
+                    stream=stream)
         else:
-            raise FossologyError(response_code, None, None)
+            response = self._send_in_background(prepped_request, timeout,
+                    deadlines, delay, stream)
+
+        if hedging:
+            self._record_latency(endpoint, time.monotonic() - start)
+        return response
 
+    def _send_in_background(self, prepped_request, timeout, deadlines,
+            delay, stream=False):
+        '''Sends a request from a worker thread
 
-    def _send_request(self, prepped_request):
+        The calling thread only waits, so it can give up when a
+            deadline passes or is cancelled, and it can send a hedged
+            copy of the request once delay seconds have passed.
+        '''
+        executor = self._get_executor()
+        call = profiling.current_call() if profiling._active else None
+        wake = threading.Event()
+        futures = []
+        attempts = {}
+
+        def submit():
+            # Only the timings of the response that is used are kept
+            attempt = None if call is None else profiling._Attempt(call)
+            future = executor.submit(self._send_once,
+                    prepped_request.copy(), timeout, attempt, stream)
+            attempts[future] = attempt
+            future.add_done_callback(lambda future: wake.set())
+            futures.append(future)
+
+        for deadline in deadlines:
+            deadline._add_waiter(wake)
+
+        hedge_at = None if delay is None else time.monotonic() + delay
+        submit()
+        error = None
+        try:
+            while True:
+                for future in [future for future in futures if future.done()]:
+                    futures.remove(future)
+                    if future.exception() is None:
+                        if attempts[future] is not None:
+                            attempts[future].adopt()
+                        return future.result()
+                    error = future.exception()
+                if not futures:
+                    raise error
+
+                for deadline in deadlines:
+                    deadline.check()
+
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if self._allow_hedge():
+                        submit()
+
+                _wait(wake, deadlines, hedge_at)
+        finally:
+            for deadline in deadlines:
+                deadline._remove_waiter(wake)
+            # Requests still running lost the race, or were abandoned
+            for future in futures:
+                future.add_done_callback(_close_response)
+
+    def _send_request(self, prepped_request, timeout=None, endpoint=None):
         '''Sends a received prepared request
 
         Returns a response object if successful, or
             throws a FossologyError
         '''
-        response = self.session.send(prepped_request)
+        response = self._send(prepped_request, timeout, endpoint)
         response_code = response.status_code
 
         # Raise an error if the request was not successful
@@ -104,45 +742,108 @@ class Connection():
         return response
 
 
-    def delete(self, url_fragments, *args, **kwargs):
-        url = _join_url(self.server, *url_fragments)
-        prepared_request = self.session.prepare_request(
-                Request(method='DELETE', url=url, *args, **kwargs))
-        return(self._send_request(prepared_request))
+    def delete(self, url_fragments, *args, timeout=None, **kwargs):
+        prepared_request = self._prepare('DELETE', url_fragments,
+                *args, **kwargs)
+        return(self._send_request(prepared_request, timeout))
 
 
-    def get(self, url_fragments, *args, **kwargs):
+    def get(self, url_fragments, *args, coalesce=True, timeout=None,
+            **kwargs):
         '''Wrapper around a sessions GET request
-        '''
-        url = _join_url(self.server, *url_fragments)
-
-        prepared_request = self.session.prepare_request(
-                Request(method='GET', url=url, *args, **kwargs))
-        return(self._send_request(prepared_request))
 
-
-    def patch(self, url_fragments, *args, **kwargs):
-        url = _join_url(self.server, *url_fragments)
-        prepared_request = self.session.prepare_request(
-                Request(method='PATCH', url=url, *args, **kwargs))
-        return(self._send_request(prepared_request))
+        Concurrent calls that result in the same URL and headers share
+            a single request, and all of them receive its response (or
+            its error). Pass coalesce=False for GETs with side effects;
+            only coalesced GETs are hedged.
+        '''
+        prepared_request = self._prepare('GET', url_fragments,
+                *args, **kwargs)
+        if not coalesce:
+            return(self._send_request(prepared_request, timeout))
+
+        # Single items and listings of a resource differ in latency
+        endpoint = ('GET', url_fragments[0], len(url_fragments)) \
+                if url_fragments else None
+        deadlines = _active_deadlines()
+        key = (prepared_request.url,
+                tuple(sorted(prepared_request.headers.items())))
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            # A call with its own deadline never leads a shared request,
+            #   so its deadline can't fail the other callers
+            leader = flight is None and not deadlines
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.coalesce_stats['sent'] += 1
+            elif flight is not None:
+                self.coalesce_stats['coalesced'] += 1
+
+        if flight is None:
+            return(self._send_request(prepared_request, timeout, endpoint))
+
+        if leader:
+            try:
+                flight.response = self._send_request(prepared_request,
+                        timeout, endpoint)
+            except BaseException as error:
+                flight.error = error
+                raise
+            finally:
+                # Nothing is kept once the response has arrived
+                with self._flights_lock:
+                    del self._flights[key]
+                flight.finish()
+            return flight.response
+
+        self._wait_for_flight(flight, deadlines)
+        if flight.error is not None:
+            raise _follower_error(flight.error) from flight.error
+        return flight.response
+
+    def _wait_for_flight(self, flight, deadlines):
+        '''Waits for a shared GET to finish within the deadlines'''
+        if not deadlines:
+            flight.done.wait()
+            return
+
+        wake = threading.Event()
+        flight.add_waiter(wake)
+        for deadline in deadlines:
+            deadline._add_waiter(wake)
+        try:
+            while not flight.done.is_set():
+                for deadline in deadlines:
+                    deadline.check()
+                _wait(wake, deadlines)
+        finally:
+            for deadline in deadlines:
+                deadline._remove_waiter(wake)
+
+
+    def patch(self, url_fragments, *args, timeout=None, **kwargs):
+        prepared_request = self._prepare('PATCH', url_fragments,
+                *args, **kwargs)
+        return(self._send_request(prepared_request, timeout))
 
 
-    def post(self, url_fragments, *args, **kwargs):
+    def post(self, url_fragments, *args, timeout=None, **kwargs):
         '''Wrapper around a sessions POST request
         '''
-        url = _join_url(self.server, *url_fragments)
-        prepared_request = self.session.prepare_request(
-                Request(method='POST', url=url, *args, **kwargs))
-        return(self._send_request(prepared_request))
+        prepared_request = self._prepare('POST', url_fragments,
+                *args, **kwargs)
+        return(self._send_request(prepared_request, timeout))
 
 
-    def put(self, url_fragments, *args, **kwargs):
-        url = _join_url(self.server, *url_fragments)
-        prepared_request = self.session.prepare_request(
-                Request(method='PUT', url=url, *args, **kwargs))
-        return(self._send_request(prepared_request))
+    def put(self, url_fragments, *args, timeout=None, **kwargs):
+        prepared_request = self._prepare('PUT', url_fragments,
+                *args, **kwargs)
+        return(self._send_request(prepared_request, timeout))
 
 
     def close_connection(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
         self.session.close()